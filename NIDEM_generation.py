@@ -14,7 +14,9 @@
 #    1. Set the locations to input datasets in the NIDEM_configuration.ini configuration .ini file
 #
 #    2. On the NCI, run the NIDEM_pbs_submit.sh shell script which iterates through a set of ITEM polygon tile IDs
-#       in parallel. This will call this script (NIDEM_generation.py) which conducts the actual analysis.
+#       in parallel. This will call this script (NIDEM_generation.py) which conducts the actual analysis. One or
+#       more polygon IDs can be passed to this script (e.g. `python NIDEM_generation.py 33 34 35`); multiple
+#       polygons are processed in parallel using a pool of worker processes.
 #
 # NIDEM consists of several output datasets:
 #
@@ -72,58 +74,70 @@
 
 import sys
 import os
+import logging
 import glob
 import fiona
 import affine
 import numpy as np
+import functools
 import collections
-import scipy.interpolate 
-from skimage.measure import find_contours
+import multiprocessing
+import concurrent.futures
+import scipy.spatial
 import configparser
-from osgeo import gdal
+from osgeo import gdal, gdal_array, osr
 from scipy import ndimage as nd
+import numba
+from numba import njit, prange, set_num_threads
 from shapely.geometry import MultiLineString, mapping
-from datacube.model import Variable
-from datacube.utils.geometry import Coordinate
-from datacube.utils.geometry import CRS
-from datacube.storage.storage import create_netcdf_storage_unit
-from datacube.storage import netcdf_writer
 
-import pandas as pd
-import geopandas as gpd
-import datacube
-from datacube.utils import geometry
-from datacube.api.query import query_group_by
-from otps import TimePoint, predict_tide
+# Modules only required to compute tidal uncertainty (`pandas`, `geopandas`, `otps` and datacube querying tools)
+# are imported on demand by the functions that use them, and datacube NetCDF tools are imported immediately before
+# NetCDF export; this avoids paying their import cost until they are needed
 
-# Connect to datacube instance
-dc = datacube.Datacube(app='NIDEM generation')
+# Configuration details are set for each process by `init_worker`; the datacube connection is only opened when
+# first required (see `get_datacube`)
+config = None
+dc = None
+
+# Number of threads used by GDAL for compression and warping; limited for each process by `init_worker`
+gdal_threads = 'ALL_CPUS'
+
+# Progress messages are reported using a module logger; detailed per-step messages are logged at DEBUG level
+logger = logging.getLogger(__name__)
 
 
 ##################
 # Generate NIDEM #
 ##################
 
-def main(argv=None):
+def process_polygon(polygon_id, decimation_pixels=None, contour_workers=None, uncertainty_array=None):
 
-    if argv is None:
+    """
+    Generates NIDEM datasets (filtered, unfiltered, mask and uncertainty GeoTIFFs, waterline contour shapefile
+    and combined NetCDF) for a single ITEM v2.0 polygon. Requires `init_worker` to have been called in the
+    current process to load configuration details.
 
-        argv = sys.argv
-        print(sys.argv)
+    :param polygon_id:
+        An integer giving the polygon ID of the ITEM v2.0 polygon to process (e.g. 33).
 
-    # If no user arguments provided
-    if len(argv) < 2:
+    :param decimation_pixels:
+        An optional integer giving the size (in pixels) of the grid cells used to thin contour vertices before
+        interpolation; only one vertex per contour height is kept in each cell (see `decimate_points`). Defaults
+        to None, which interpolates using every contour vertex. Thinning speeds up triangulation, but changes
+        interpolated elevations (particularly where contours are closely spaced), so is not used to produce the
+        published NIDEM datasets. When run as a script, this is set by `decimation_pixels` in the
+        'Processing options' section of NIDEM_configuration.ini.
 
-        str_usage = "You must specify a polygon ID"
-        print(str_usage)
-        sys.exit()
+    :param contour_workers:
+        An optional integer giving the number of worker processes used to assemble contour lines for each contour
+        height in parallel (see `multi_contour`). Defaults to None, which assembles contours in the current process.
 
-    # Set ITEM polygon for analysis
-    polygon_id = int(argv[1])  # polygon_id = 33
+    :param uncertainty_array:
+        An optional array of shape (9,) giving precomputed uncertainties for each ITEM interval (see
+        `interval_uncertainty`). Defaults to None, which computes uncertainties for the polygon.
 
-    # Import configuration details from NIDEM_configuration.ini
-    config = configparser.ConfigParser()
-    config.read('NIDEM_configuration.ini')
+    """
 
     # Set paths to ITEM relative, confidence and offset products
     item_offset_path = config['ITEM inputs']['item_offset_path']
@@ -138,13 +152,13 @@ def main(argv=None):
     nthaus30_raster = config['Masking inputs']['nthaus30_raster']
 
     # Print run details
-    print('Processing polygon {} from {}'.format(polygon_id, item_offset_path))
+    logger.info('Processing polygon %s from %s', polygon_id, item_offset_path)
 
     ##################################
     # Import and prepare ITEM raster #
     ##################################
 
-    # Contours generated by `skimage.measure.find_contours` stop before the edge of nodata pixels. To prevent gaps
+    # Contours generated by marching squares stop before the edge of nodata pixels. To prevent gaps
     # from occurring between adjacent NIDEM tiles, the following steps 'fill' pixels directly on the boundary of
     # two NIDEM tiles with the value of the nearest pixel with data.
 
@@ -164,27 +178,28 @@ def main(argv=None):
     bottomright_x = upleft_x + (x_size * xcols)
     bottomright_y = upleft_y + (y_size * yrows)
 
-    # Identify valid intertidal area by selecting pixels between the lowest and highest ITEM intervals. This is
-    # subsequently used to restrict the extent of interpolated elevation data to match the input ITEM polygons.
-    valid_intertidal_extent = np.where((item_array > 0) & (item_array < 9), 1, 0)
+    # Keep the original ITEM intervals, which are subsequently used to identify valid intertidal area (pixels between
+    # the lowest and highest ITEM intervals) to restrict the extent of interpolated elevation data to match the input
+    # ITEM polygons.
+    item_intervals = item_array
 
     # Convert datatype to float to allow assigning nodata -6666 values to NaN
     item_array = item_array.astype('float32')
     item_array[item_array == -6666] = np.nan
 
-    # First, identify areas to be filled by dilating non-NaN pixels by two pixels (i.e. ensuring vertical, horizontal
-    # and diagonally adjacent pixels are filled):
-    dilated_mask = nd.morphology.binary_dilation(~np.isnan(item_array), iterations=2)
+    # Identify pixels with data once, for re-use in both of the following steps
+    valid_mask = ~np.isnan(item_array)
 
-    # For every pixel, identify the indices of the nearest pixel with data (i.e. data pixels will return their own
-    # indices; nodata pixels will return the indices of the nearest data pixel). This output can be used to index
-    # back into the original array, returning a new array where data pixels remain the same, but every nodata pixel
-    # is filled with the value of the nearest data pixel:
-    nearest_inds = nd.distance_transform_edt(input=np.isnan(item_array), return_distances=False, return_indices=True)
-    item_array = item_array[tuple(nearest_inds)]
+    # First, identify areas to be filled by dilating non-NaN pixels by two pixels (i.e. ensuring vertical, horizontal
+    # and diagonally adjacent pixels are filled). This uses a single dilation with a 5 x 5 diamond-shaped structuring
+    # element, which is equivalent to (but faster than) two iterations of dilation with a 3 x 3 cross:
+    dilated_mask = nd.binary_dilation(valid_mask, structure=FILL_RING_STRUCTURE)
 
-    # As we only want to fill pixels on the boundary of NIDEM tiles, set pixels outside the dilated area back to NaN:
-    item_array[~dilated_mask] = np.nan
+    # Then, fill every nodata pixel within this dilated area with the value of the nearest pixel with data. Because
+    # the dilated area only extends two pixels from pixels with data, the nearest data pixel can be found by
+    # searching the small neighbourhood of each pixel in order of increasing distance (see `fill_ring`); pixels
+    # outside the dilated area are left as NaN:
+    fill_ring(item_array, valid_mask, dilated_mask)
 
     ##########################################
     # Median and SD tide height per interval #
@@ -207,15 +222,15 @@ def main(argv=None):
     # return an estimate of uncertainty for each individual pixel in the NIDEM datasets: larger values indicate the
     # ITEM interval was produced from a composite of images with a larger range of tide heights.
 
-    # Compute uncertainties for each interval, and create a lookup dict to link uncertainties to each NIDEM contour
-    uncertainty_array = interval_uncertainty(polygon_id=polygon_id, item_polygon_path=item_polygon_path)
-    uncertainty_dict = dict(zip(contour_offsets, uncertainty_array))
+    # Compute uncertainties for each interval, unless already computed (e.g. for a batch of polygons by `run_batch`)
+    if uncertainty_array is None:
+        uncertainty_array = interval_uncertainty(polygon_id=polygon_id, item_polygon_path=item_polygon_path)
 
     ####################
     # Extract contours #
     ####################
 
-    # Here, we use `skimage.measure.find_contours` to extract contours along the boundary of each ITEM tidal interval
+    # Here, we use marching squares to extract contours along the boundary of each ITEM tidal interval
     # (e.g. 0.5 is the boundary between ITEM interval 0 and interval 1; 5.5 is the boundary between interval 5 and
     # interval 6). This function outputs a dictionary with ITEM interval boundaries as keys and lists of xy point
     # arrays as values. Contours are also exported as a shapefile with elevation and uncertainty attributes in metres.
@@ -226,41 +241,74 @@ def main(argv=None):
                                    output_shp=f'output_data/shapefile/nidem_contours/'
                                               f'NIDEM_contours_{polygon_id}_{coord_str}.shp',
                                    attribute_data={'elev_m': contour_offsets, 'uncert_m': uncertainty_array},
-                                   attribute_dtypes={'elev_m': 'float:9.2', 'uncert_m': 'float:9.2'})
+                                   attribute_dtypes={'elev_m': 'float:9.2', 'uncert_m': 'float:9.2'},
+                                   max_workers=contour_workers)
 
     #######################################################################
     # Interpolate contours using TIN/Delaunay triangulation interpolation #
     #######################################################################
 
     # Here we assign each previously generated contour with its modelled height relative to MSL, producing a set of
-    # tidally tagged xyz points that can be used to interpolate elevations across the intertidal zone. We use the
-    # linear interpolation method from `scipy.interpolate.griddata`, which computes a TIN/Delaunay triangulation of
-    # the input data using Qhull before performing linear barycentric interpolation on each triangle.
+    # tidally tagged xyz points that can be used to interpolate elevations across the intertidal zone. We compute a
+    # TIN/Delaunay triangulation of the input data using Qhull (`scipy.spatial.Delaunay`), and then perform linear
+    # barycentric interpolation on each triangle (see `tin_interpolate`).
 
     # If contours include valid data, proceed with interpolation
     try:
 
-        # Combine all individual contours for each contour height, and insert a height above MSL column into array
-        elev_contours = [np.insert(np.concatenate(v), 2, contour_offsets[i], axis=1) for i, v in
-                         enumerate(contour_dict.values())]
-
-        # Combine all contour heights into a single array, and then extract xy points and z-values
-        all_contours = np.concatenate(elev_contours)
-        points_xy = all_contours[:, [1, 0]]
-        values_elev = all_contours[:, 2]
-
-        # Create a matching list of uncertainty values for each xy point
-        values_uncert = np.array([np.round(uncertainty_dict[i], 2) for i in values_elev])
-
-        # Calculate bounds of ITEM layer to create interpolation grid (from-to-by values in metre units)
-        grid_y, grid_x = np.mgrid[upleft_y:bottomright_y:1j * yrows, upleft_x:bottomright_x:1j * xcols]
-
-        # Interpolate between points onto grid. This uses the 'linear' method from
-        # scipy.interpolate.griddata, which computes a TIN/Delaunay triangulation of the input
-        # data with Qhull and performs linear barycentric interpolation on each triangle
-        print('Interpolating data for polygon {}'.format(polygon_id))
-        interp_elev_array = scipy.interpolate.griddata(points_xy, values_elev, (grid_y, grid_x), method='linear')
-        interp_uncert_array = scipy.interpolate.griddata(points_xy, values_uncert, (grid_y, grid_x), method='linear')
+        # Combine all individual contours for each contour height into flat, parallel arrays of y and x coordinates,
+        # and create matching arrays of heights above MSL and (rounded) uncertainty values for each xy point.
+        # Uncertainties are looked up by contour height; where heights are duplicated, the uncertainty of the last
+        # matching interval is used
+        uncertainty_lookup = dict(zip(contour_offsets, uncertainty_array))
+        ys, xs, zs, us = [], [], [], []
+        for i, v in enumerate(contour_dict.values()):
+            contour_points = np.concatenate(v)
+
+            # Contours contain approximately one vertex for every pixel they cross, which produces very dense
+            # clusters of points that slow down triangulation. If requested, thin these by keeping only the first
+            # vertex of each contour height within each cell of a coarse grid
+            if decimation_pixels:
+                contour_points = decimate_points(contour_points, cell_size=decimation_pixels * abs(x_size))
+
+            ys.append(contour_points[:, 1])
+            xs.append(contour_points[:, 0])
+            zs.append(np.full(len(contour_points), contour_offsets[i], dtype=np.float32))
+            us.append(np.full(len(contour_points), np.round(uncertainty_lookup[contour_offsets[i]], 2),
+                              dtype=np.float32))
+
+        # Combine all contour heights into single arrays of xy points, z-values and uncertainty values. As NIDEM is
+        # exported as float32, z-values and uncertainty values are interpolated as float32 to halve memory use; xy
+        # points remain float64, as float32 cannot precisely represent Albers coordinates (~0.1 m precision)
+        points_xy = np.column_stack([np.concatenate(ys), np.concatenate(xs)])
+        values_elev = np.concatenate(zs)
+        values_uncert = np.concatenate(us)
+
+        # Calculate bounds of ITEM layer to create interpolation grid (from-to-by values in metre units). Rather
+        # than materialising full 2D coordinate arrays for the entire grid, only the 1D vectors of y and x
+        # coordinates are computed here; these are kept as float64 for the same precision reasons as `points_xy`
+        grid_y = np.linspace(upleft_y, bottomright_y, yrows)
+        grid_x = np.linspace(upleft_x, bottomright_x, xcols)
+
+        # Interpolate between points onto grid. This computes a single TIN/Delaunay triangulation of the input
+        # data with Qhull, then locates the triangle containing each grid cell and its barycentric weights once.
+        # These weights are shared by both the elevation and uncertainty interpolations, which is equivalent
+        # to the 'linear' method from scipy.interpolate.griddata (linear barycentric interpolation on each triangle)
+        logger.info('Interpolating data for polygon %s', polygon_id)
+        tri = scipy.spatial.Delaunay(points_xy)
+        interp_elev_array = np.empty((yrows, xcols), dtype=values_elev.dtype)
+        interp_uncert_array = np.empty((yrows, xcols), dtype=values_uncert.dtype)
+
+        # Grid cells are interpolated in blocks of rows, broadcasting the 1D coordinate vectors into query points
+        # for one block at a time. This keeps the temporary arrays used by `tin_interpolate` (~100 bytes per point)
+        # small and cache-friendly regardless of the size of the ITEM polygon
+        block_rows = max(1, INTERP_BLOCK_POINTS // xcols)
+        for row in range(0, yrows, block_rows):
+            block_y = grid_y[row:row + block_rows]
+            grid_points = np.column_stack([np.repeat(block_y, xcols), np.tile(grid_x, len(block_y))])
+            block_elev, block_uncert = tin_interpolate(tri, grid_points, [values_elev, values_uncert])
+            interp_elev_array[row:row + len(block_y)] = block_elev.reshape(-1, xcols)
+            interp_uncert_array[row:row + len(block_y)] = block_uncert.reshape(-1, xcols)
 
     except ValueError:
 
@@ -288,28 +336,26 @@ def main(argv=None):
     conf_filename = glob.glob('{}/ITEM_STD_{}_*.tif'.format(item_conf_path, polygon_id))[0]
     conf_ds = gdal.Open(conf_filename)
 
-    # Reproject SRTM-derived 1 Second DEM to cell size and projection of NIDEM
+    # Reproject SRTM-derived 1 Second DEM to cell size and projection of NIDEM. No `output_raster` is given, so each
+    # of the following reprojected datasets is created in memory rather than written to disk. The already open ITEM
+    # dataset is used as a template, to avoid re-opening the ITEM raster for every reprojection
     srtm30_reproj = reproject_to_template(input_raster=srtm30_raster,
-                                          template_raster=item_filename,
-                                          output_raster='scratch/temp.tif',
+                                          template_raster=item_ds,
                                           nodata_val=-9999)
 
     # Reproject Australian Bathymetry and Topography Grid to cell size and projection of NIDEM
     ausbath09_reproj = reproject_to_template(input_raster=ausbath09_raster,
-                                             template_raster=item_filename,
-                                             output_raster='scratch/temp.tif',
+                                             template_raster=item_ds,
                                              nodata_val=-9999)
 
     # Reproject gbr30 bathymetry to cell size and projection of NIDEM
     gbr30_reproj = reproject_to_template(input_raster=gbr30_raster,
-                                         template_raster=item_filename,
-                                         output_raster='scratch/temp.tif',
+                                         template_raster=item_ds,
                                          nodata_val=-9999)
 
     # Reproject nthaus30 bathymetry to cell size and projection of NIDEM
     nthaus30_reproj = reproject_to_template(input_raster=nthaus30_raster,
-                                            template_raster=item_filename,
-                                            output_raster='scratch/temp.tif',
+                                            template_raster=item_ds,
                                             nodata_val=-9999)
 
     # Convert raster datasets to arrays
@@ -319,22 +365,13 @@ def main(argv=None):
     gbr30_array = gbr30_reproj.GetRasterBand(1).ReadAsArray()
     nthaus30_array = nthaus30_reproj.GetRasterBand(1).ReadAsArray()
 
-    # Convert arrays to boolean masks:
-    #  For elevation: any elevations > 25 m in SRTM 30m DEM
-    #  For bathymetry: any depths < -25 m in GBR30 AND nthaus30 AND Ausbath09 bathymetry
-    #  For ITEM confidence: any cells with NDWI STD > 0.25
-    elev_mask = srtm30_array > 25
-    bathy_mask = (ausbath09_array < -25) & (gbr30_array < -25) & (nthaus30_array < -25)
-    conf_mask = conf_array > 0.25
-
     # Create a combined mask with -9999 nodata in unmasked areas and where:
-    #  1 = elevation mask
-    #  2 = bathymetry mask
-    #  3 = ITEM confidence mask
-    nidem_mask = np.full(item_array.shape, -9999)
-    nidem_mask[elev_mask] = 1
-    nidem_mask[bathy_mask] = 2
-    nidem_mask[conf_mask] = 3
+    #  1 = elevation mask: any elevations > 25 m in SRTM 30m DEM
+    #  2 = bathymetry mask: any depths < -25 m in GBR30 AND nthaus30 AND Ausbath09 bathymetry
+    #  3 = ITEM confidence mask: any cells with NDWI STD > 0.25
+    # Where masks overlap, later masks take precedence (e.g. ITEM confidence overrides elevation and bathymetry)
+    nidem_mask = np.full(item_array.shape, -9999, dtype=np.int16)
+    build_mask(srtm30_array, ausbath09_array, gbr30_array, nthaus30_array, conf_array, nidem_mask)
 
     ################################
     # Export output NIDEM geoTIFFs #
@@ -342,51 +379,83 @@ def main(argv=None):
 
     # Because the lowest and highest ITEM intervals (0 and 9) cannot be correctly interpolated as they have no lower
     # or upper bounds, the NIDEM layers are constrained to valid intertidal terrain (ITEM intervals 1-8).
-    nidem_uncertainty = np.where(valid_intertidal_extent, interp_uncert_array, -9999).astype(np.float32)
-    nidem_unfiltered = np.where(valid_intertidal_extent, interp_elev_array, -9999).astype(np.float32)
-
+    #
     # NIDEM is exported as two DEMs: an unfiltered layer, and a layer that is filtered to remove terrestrial (> 25 m)
     # and sub-tidal terrain (< -25 m) and pixels with high ITEM confidence NDWI standard deviation. Here we mask
-    # the unfiltered layer by NIDEM mask to produce a filtered NIDEM layer:
-    nidem_filtered = np.where(nidem_mask > 0, -9999, nidem_unfiltered).astype(np.float32)
-
-    # Export filtered NIDEM as a GeoTIFF
-    print(f'Exporting filtered NIDEM for polygon {polygon_id}')
-    array_to_geotiff(fname=f'output_data/geotiff/nidem/NIDEM_{polygon_id}_{coord_str}.tif',
-                     data=nidem_filtered,
-                     geo_transform=geotrans,
-                     projection=prj,
-                     nodata_val=-9999)
-
-    # Export unfiltered NIDEM as a GeoTIFF
-    print(f'Exporting unfiltered NIDEM for polygon {polygon_id}')
-    array_to_geotiff(fname=f'output_data/geotiff/nidem_unfiltered/NIDEM_unfiltered_{polygon_id}_{coord_str}.tif',
-                     data=nidem_unfiltered,
-                     geo_transform=geotrans,
-                     projection=prj,
-                     nodata_val=-9999)
-
-    # Export NIDEM uncertainty layer as a GeoTIFF
-    print(f'Exporting NIDEM uncertainty for polygon {polygon_id}')
-    array_to_geotiff(fname=f'output_data/geotiff/nidem_uncertainty/NIDEM_uncertainty_{polygon_id}_{coord_str}.tif',
-                     data=nidem_uncertainty,
-                     geo_transform=geotrans,
-                     projection=prj,
-                     nodata_val=-9999)
-
-    # Export NIDEM mask as a GeoTIFF
-    print(f'Exporting NIDEM mask for polygon {polygon_id}')
-    array_to_geotiff(fname=f'output_data/geotiff/nidem_mask/NIDEM_mask_{polygon_id}_{coord_str}.tif',
-                     data=nidem_mask.astype(int),
-                     geo_transform=geotrans,
-                     projection=prj,
-                     dtype=gdal.GDT_Int16,
-                     nodata_val=-9999)
+    # the unfiltered layer by NIDEM mask to produce a filtered NIDEM layer. All three output layers are computed
+    # together in a single pass:
+    nidem_unfiltered = np.empty((yrows, xcols), dtype=np.float32)
+    nidem_uncertainty = np.empty((yrows, xcols), dtype=np.float32)
+    nidem_filtered = np.empty((yrows, xcols), dtype=np.float32)
+    finalize(item_intervals, interp_elev_array, interp_uncert_array, nidem_mask,
+             nidem_unfiltered, nidem_uncertainty, nidem_filtered)
+
+    # The four NIDEM GeoTIFFs are independent, so are exported concurrently using a pool of threads (GDAL releases
+    # the GIL while compressing and writing data to disk). GDAL threads for this process are split between the
+    # concurrent exports so they do not use more CPUs than are allocated to this process in total
+    total_threads = os.cpu_count() if gdal_threads == 'ALL_CPUS' else int(gdal_threads)
+    export_workers = min(4, total_threads)
+    export_threads = max(1, total_threads // export_workers)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=export_workers) as executor:
+
+        # Export filtered NIDEM as a GeoTIFF
+        logger.info('Exporting filtered NIDEM for polygon %s', polygon_id)
+        filtered_export = executor.submit(array_to_geotiff,
+                                          fname=f'output_data/geotiff/nidem/NIDEM_{polygon_id}_{coord_str}.tif',
+                                          data=nidem_filtered,
+                                          geo_transform=geotrans,
+                                          projection=prj,
+                                          nodata_val=-9999,
+                                          num_threads=export_threads)
+
+        # Export unfiltered NIDEM as a GeoTIFF
+        logger.info('Exporting unfiltered NIDEM for polygon %s', polygon_id)
+        unfiltered_export = executor.submit(array_to_geotiff,
+                                            fname=f'output_data/geotiff/nidem_unfiltered/'
+                                                  f'NIDEM_unfiltered_{polygon_id}_{coord_str}.tif',
+                                            data=nidem_unfiltered,
+                                            geo_transform=geotrans,
+                                            projection=prj,
+                                            nodata_val=-9999,
+                                            num_threads=export_threads)
+
+        # Export NIDEM uncertainty layer as a GeoTIFF
+        logger.info('Exporting NIDEM uncertainty for polygon %s', polygon_id)
+        uncertainty_export = executor.submit(array_to_geotiff,
+                                             fname=f'output_data/geotiff/nidem_uncertainty/'
+                                                   f'NIDEM_uncertainty_{polygon_id}_{coord_str}.tif',
+                                             data=nidem_uncertainty,
+                                             geo_transform=geotrans,
+                                             projection=prj,
+                                             nodata_val=-9999,
+                                             num_threads=export_threads)
+
+        # Export NIDEM mask as a GeoTIFF
+        logger.info('Exporting NIDEM mask for polygon %s', polygon_id)
+        mask_export = executor.submit(array_to_geotiff,
+                                      fname=f'output_data/geotiff/nidem_mask/NIDEM_mask_{polygon_id}_{coord_str}.tif',
+                                      data=nidem_mask,
+                                      geo_transform=geotrans,
+                                      projection=prj,
+                                      dtype=gdal.GDT_Int16,
+                                      nodata_val=-9999,
+                                      num_threads=export_threads)
+
+        # Wait for all exports to finish, raising any errors that occurred while writing
+        for export in (filtered_export, unfiltered_export, uncertainty_export, mask_export):
+            export.result()
 
     ######################
     # Export NetCDF data #
     ######################
 
+    from datacube.model import Variable
+    from datacube.utils.geometry import Coordinate
+    from datacube.utils.geometry import CRS
+    from datacube.storage.storage import create_netcdf_storage_unit
+    from datacube.storage import netcdf_writer
+
     # If netcdf file already exists, delete it
     filename_netcdf = f'output_data/netcdf/NIDEM_{polygon_id}_{coord_str}.nc'
 
@@ -397,8 +466,11 @@ def main(argv=None):
     x_coords = netcdf_writer.netcdfy_coord(np.linspace(upleft_x + 12.5, bottomright_x - 12.5, num=xcols))
     y_coords = netcdf_writer.netcdfy_coord(np.linspace(upleft_y - 12.5, bottomright_y + 12.5, num=yrows))
 
-    # Define output compression parameters
-    comp_params = dict(zlib=True, complevel=9, shuffle=True, fletcher32=True)
+    # Define output compression parameters. DEFLATE level 4 gives very similar file sizes to level 9 for these
+    # (shuffled) float32 layers, but compresses several times faster. Data is stored in 512 x 512 pixel chunks
+    # (matching the tiling of the output GeoTIFFs) so that each layer is compressed in whole, aligned chunks
+    comp_params = dict(zlib=True, complevel=4, shuffle=True, fletcher32=True,
+                       chunksizes=(min(512, yrows), min(512, xcols)))
 
     # Create new dataset
     output_netcdf = create_netcdf_storage_unit(filename=filename_netcdf,
@@ -494,11 +566,242 @@ def main(argv=None):
     output_netcdf.close()
 
 
+# Structuring element used to identify pixels within two pixels of a pixel with data (a 5 x 5 diamond)
+FILL_RING_STRUCTURE = nd.iterate_structure(nd.generate_binary_structure(2, 1), 2)
+
+# Pixel offsets (row, col) within two pixels of a central pixel, sorted by increasing Euclidean distance
+# (1, sqrt(2), 2). Used by `fill_ring` to find the nearest pixel with data. Offsets at the same distance are
+# sorted by column then row, which resolves ties between equally near pixels in the same way as
+# `scipy.ndimage.distance_transform_edt`
+FILL_RING_OFFSETS = np.array([(0, -1), (-1, 0), (1, 0), (0, 1),
+                              (-1, -1), (1, -1), (-1, 1), (1, 1),
+                              (0, -2), (-2, 0), (2, 0), (0, 2)])
+
+
+@njit(cache=True)
+def fill_ring(arr, valid_mask, ring_mask):
+
+    """
+    Fills nodata pixels in a narrow ring around pixels with data with the value of the nearest pixel with data.
+    This is equivalent to filling pixels with a nearest-neighbour lookup from
+    `scipy.ndimage.distance_transform_edt(..., return_indices=True)`, but only visits a small neighbourhood of
+    pixels within the ring rather than computing a distance transform for the entire array.
+
+    The ring must extend no more than two pixels from any pixel with data (e.g. a mask obtained by dilating
+    `valid_mask` twice using `scipy.ndimage.binary_dilation`), which guarantees that the nearest pixel with data
+    is always one of the pixels in `FILL_RING_OFFSETS`. Where several pixels with data are equally near, the
+    first in `FILL_RING_OFFSETS` is used, which matches the pixel chosen by the distance transform.
+
+    :param arr:
+        A two-dimensional array to fill. This is modified in-place.
+
+    :param valid_mask:
+        A boolean array of the same shape as `arr` that is True for pixels with data.
+
+    :param ring_mask:
+        A boolean array of the same shape as `arr` that is True for pixels that should be filled. Nodata pixels
+        outside of this mask are left unchanged.
+
+    """
+
+    rows, cols = arr.shape
+
+    for y in range(rows):
+        for x in range(cols):
+
+            # Only fill nodata pixels within the ring
+            if ring_mask[y, x] and not valid_mask[y, x]:
+
+                # Assign value of the first (i.e. nearest) neighbouring pixel with data
+                for i in range(FILL_RING_OFFSETS.shape[0]):
+                    ny = y + FILL_RING_OFFSETS[i, 0]
+                    nx = x + FILL_RING_OFFSETS[i, 1]
+
+                    if 0 <= ny < rows and 0 <= nx < cols and valid_mask[ny, nx]:
+                        arr[y, x] = arr[ny, nx]
+                        break
+
+
+@njit(parallel=True, cache=True)
+def build_mask(srtm30_array, ausbath09_array, gbr30_array, nthaus30_array, conf_array, out):
+
+    """
+    Computes the NIDEM mask from elevation, bathymetry and ITEM confidence arrays in a single pass over
+    each pixel. Pixels are flagged as:
+
+    1 = elevation mask: elevations > 25 m in `srtm30_array`
+    2 = bathymetry mask: depths < -25 m in all of `ausbath09_array`, `gbr30_array` and `nthaus30_array`
+    3 = ITEM confidence mask: NDWI standard deviation > 0.25 in `conf_array`
+
+    Where masks overlap, higher values take precedence. Pixels that are not flagged by any mask are
+    left unchanged.
+
+    :param srtm30_array:
+        A two-dimensional array of SRTM-derived elevations in metres.
+
+    :param ausbath09_array:
+        A two-dimensional array of Australian Bathymetry and Topography Grid values in metres.
+
+    :param gbr30_array:
+        A two-dimensional array of gbr30 bathymetry values in metres.
+
+    :param nthaus30_array:
+        A two-dimensional array of nthaus30 bathymetry values in metres.
+
+    :param conf_array:
+        A two-dimensional array of ITEM confidence NDWI standard deviation values.
+
+    :param out:
+        A two-dimensional integer array of the same shape as the inputs (e.g. filled with a -9999 nodata value)
+        that is updated in-place with mask values.
+
+    """
+
+    rows, cols = out.shape
+
+    for y in prange(rows):
+        for x in range(cols):
+
+            if conf_array[y, x] > 0.25:
+                out[y, x] = 3
+            elif (ausbath09_array[y, x] < -25) and (gbr30_array[y, x] < -25) and (nthaus30_array[y, x] < -25):
+                out[y, x] = 2
+            elif srtm30_array[y, x] > 25:
+                out[y, x] = 1
+
+
+@njit(parallel=True, cache=True)
+def finalize(item_intervals, interp_elev_array, interp_uncert_array, nidem_mask,
+             out_unfiltered, out_uncertainty, out_filtered):
+
+    """
+    Computes the unfiltered NIDEM, NIDEM uncertainty and filtered NIDEM output layers in a single pass over each
+    pixel. Interpolated elevation and uncertainty values are retained only for valid intertidal terrain (ITEM
+    intervals 1-8), and the filtered NIDEM layer additionally sets any pixel flagged by the NIDEM mask to nodata.
+    All other pixels are assigned a -9999 nodata value.
+
+    :param item_intervals:
+        A two-dimensional array of ITEM tidal intervals.
+
+    :param interp_elev_array:
+        A two-dimensional array of interpolated elevations.
+
+    :param interp_uncert_array:
+        A two-dimensional array of interpolated uncertainty values.
+
+    :param nidem_mask:
+        A two-dimensional array of NIDEM mask values, where values greater than 0 are masked.
+
+    :param out_unfiltered:
+        A float32 output array for the unfiltered NIDEM layer, updated in-place.
+
+    :param out_uncertainty:
+        A float32 output array for the NIDEM uncertainty layer, updated in-place.
+
+    :param out_filtered:
+        A float32 output array for the filtered NIDEM layer, updated in-place.
+
+    """
+
+    rows, cols = item_intervals.shape
+
+    for y in prange(rows):
+        for x in range(cols):
+
+            if 0 < item_intervals[y, x] < 9:
+                out_unfiltered[y, x] = interp_elev_array[y, x]
+                out_uncertainty[y, x] = interp_uncert_array[y, x]
+            else:
+                out_unfiltered[y, x] = -9999
+                out_uncertainty[y, x] = -9999
+
+            out_filtered[y, x] = -9999 if nidem_mask[y, x] > 0 else out_unfiltered[y, x]
+
+
+def decimate_points(points, cell_size):
+
+    """
+    Thins a set of points by dividing space into a regular grid of square cells, and keeping only the first
+    point that falls within each cell. The original order of the retained points is preserved.
+
+    :param points:
+        An array of shape (n, 2) giving the coordinates of each point.
+
+    :param cell_size:
+        The width of each grid cell, in the same units as `points`.
+
+    :return:
+        An array of shape (m, 2) giving the coordinates of the retained points, where m <= n.
+
+    """
+
+    # Identify grid cell of each point, and the index of the first point within each cell
+    cells = np.floor(points / cell_size).astype(np.int64)
+    _, first_inds = np.unique(cells, axis=0, return_index=True)
+
+    return points[np.sort(first_inds)]
+
+
+# Maximum number of grid cells interpolated at once by `process_polygon` (~1 million cells, or ~100 MB of
+# temporary arrays in `tin_interpolate`)
+INTERP_BLOCK_POINTS = 2 ** 20
+
+
+def tin_interpolate(tri, points, values):
+
+    """
+    Linearly interpolates one or more sets of values onto a set of points using a precomputed TIN/Delaunay
+    triangulation. The triangle containing each point and its barycentric weights are computed once and then
+    re-used for every set of values, making this more efficient than calling `scipy.interpolate.griddata` or
+    `scipy.interpolate.LinearNDInterpolator` separately for each set of values.
+
+    Barycentric weights are computed in float64, but are applied in float32 if all `values` are float32 (or
+    smaller); this halves the memory used for interpolation when float32 outputs are sufficient.
+
+    :param tri:
+        A `scipy.spatial.Delaunay` triangulation of the input data points.
+
+    :param points:
+        An array of shape (n, 2) giving the coordinates of the points to interpolate values onto. These must be
+        in the same coordinate order as the points used to compute `tri`.
+
+    :param values:
+        A list of arrays of values to interpolate, each with one value for every input data point used to compute
+        `tri`.
+
+    :return:
+        A list of arrays of shape (n,) with interpolated values for each array in `values`. Points that fall
+        outside the convex hull of the input data are assigned NaN.
+
+    """
+
+    # Identify the triangle containing each point, and compute its barycentric coordinates within the triangle
+    simplex = tri.find_simplex(points)
+    transform = tri.transform[simplex]
+    bary = np.einsum('ijk,ik->ij', transform[:, :2, :], points - transform[:, 2, :])
+    weights = np.column_stack([bary, 1 - bary.sum(axis=1)]).astype(np.result_type(np.float32, *values))
+
+    # Identify vertices of each triangle, and points outside the convex hull of the input data
+    vertices = tri.simplices[simplex]
+    outside_hull = simplex == -1
+
+    # Interpolate each set of values as the weighted sum of values at the vertices of each triangle
+    interpolated = []
+    for vals in values:
+        interp = np.einsum('ij,ij->i', np.asarray(vals)[vertices], weights)
+        interp[outside_hull] = np.nan
+        interpolated.append(interp)
+
+    return interpolated
+
+
 def array_to_geotiff(fname, data, geo_transform, projection,
-                     nodata_val=0, dtype=gdal.GDT_Float32):
+                     nodata_val=0, dtype=gdal.GDT_Float32, compression='DEFLATE', creation_options=None,
+                     cloud_optimised=True, num_threads=None):
 
     """
-    Create a single band GeoTIFF file with data from an array.
+    Create a single band GeoTIFF file with data from an array. By default, this is written as a
+    Cloud Optimised GeoTIFF (COG) with internal overviews if GDAL supports the COG driver.
 
     Because this works with simple arrays rather than xarray datasets from DEA, it requires
     geotransform info ("(upleft_x, x_size, x_rotation, upleft_y, y_rotation, y_size)") and
@@ -527,28 +830,94 @@ def array_to_geotiff(fname, data, geo_transform, projection,
         Optionally set the dtype of the output raster; can be useful when exporting
         an array of float or integer values. Defaults to gdal.GDT_Float32
 
+    :param compression:
+        Optionally set the compression method used by the default creation options; defaults
+        to 'DEFLATE'. 'ZSTD' can be used for faster compression if GDAL is built with ZSTD
+        support
+
+    :param creation_options:
+        Optionally set a sequence of GDAL GeoTIFF creation options, which overrides the
+        defaults. Defaults to None, which creates a tiled raster with 512 x 512 pixel blocks,
+        compressed using `compression` with multithreaded compression, a floating point
+        predictor for float data (or a horizontal differencing predictor for integer data),
+        and BigTIFF format if required. Only used when a standard GeoTIFF is written
+
+    :param cloud_optimised:
+        Optionally write a Cloud Optimised GeoTIFF with internal overviews using the GDAL COG
+        driver (GDAL >= 3.1). Defaults to True; falls back to a standard tiled GeoTIFF if the
+        COG driver is not available. Overviews of integer (e.g. mask) rasters are resampled using
+        nearest neighbour so they only contain valid class values
+
+    :param num_threads:
+        Optionally set the number of threads used to compress data. Defaults to None, which uses the
+        number of GDAL threads set for this process by `init_worker` (or all available CPUs)
+
     """
 
+    num_threads = num_threads or gdal_threads
+
+    # The COG driver cannot create a raster to be written into block by block, so instead copies the array from
+    # an in-memory raster that directly wraps the array data (without copying it)
+    cog_driver = gdal.GetDriverByName('COG') if cloud_optimised else None
+
+    if cog_driver is not None:
+
+        level_option = {'DEFLATE': 'LEVEL=6', 'ZSTD': 'LEVEL=9'}.get(compression.upper())
+        cog_options = [f'COMPRESS={compression}', 'BLOCKSIZE=512', f'NUM_THREADS={num_threads}', 'PREDICTOR=YES',
+                       'OVERVIEWS=AUTO', 'BIGTIFF=IF_SAFER'] + ([level_option] if level_option else [])
+
+        # The COG driver's default overview resampling suits continuous float data, but would blend neighbouring
+        # class values in integer rasters such as the NIDEM mask, so use nearest neighbour for these instead
+        if dtype not in (gdal.GDT_Float32, gdal.GDT_Float64):
+            cog_options.append('RESAMPLING=NEAREST')
+
+        data = np.ascontiguousarray(data, dtype=gdal_array.GDALTypeCodeToNumericTypeCode(dtype))
+        mem_ds = gdal_array.OpenArray(data)
+        mem_ds.SetGeoTransform(geo_transform)
+        mem_ds.SetProjection(projection)
+        mem_ds.GetRasterBand(1).SetNoDataValue(nodata_val)
+        dataset = cog_driver.CreateCopy(fname, mem_ds, options=cog_options)
+
+        # Close files
+        dataset = None
+        mem_ds = None
+        return
+
     # Set up driver
     driver = gdal.GetDriverByName('GTiff')
 
+    # Set up creation options. Outputs are written as internally tiled, compressed rasters, using `num_threads`
+    # CPUs to compress data. The floating point predictor (3) compresses smooth float elevation data much better
+    # than horizontal differencing (2), which is only used for integer data. DEFLATE compression is fastest when
+    # GDAL is built with libdeflate
+    if creation_options is None:
+        float_dtype = dtype in (gdal.GDT_Float32, gdal.GDT_Float64)
+        level_option = {'DEFLATE': 'ZLEVEL=6', 'ZSTD': 'ZSTD_LEVEL=9'}.get(compression.upper())
+        creation_options = [f'COMPRESS={compression}', 'TILED=YES', 'BLOCKXSIZE=512', 'BLOCKYSIZE=512',
+                            f'NUM_THREADS={num_threads}', 'PREDICTOR=3' if float_dtype else 'PREDICTOR=2',
+                            'BIGTIFF=IF_SAFER'] + ([level_option] if level_option else [])
+
     # Create raster of given size and projection
     rows, cols = data.shape
-    dataset = driver.Create(fname, cols, rows, 1, dtype, ['COMPRESS=DEFLATE'])
+    dataset = driver.Create(fname, cols, rows, 1, dtype, list(creation_options))
     dataset.SetGeoTransform(geo_transform)
     dataset.SetProjection(projection)
 
-    # Write data to array and set nodata values
+    # Write data to array one block at a time and set nodata values. Writing whole, block-aligned windows lets
+    # GDAL write each block directly rather than copying it through the block cache
     band = dataset.GetRasterBand(1)
-    band.WriteArray(data)
+    block_x, block_y = band.GetBlockSize()
+    for yoff in range(0, rows, block_y):
+        for xoff in range(0, cols, block_x):
+            band.WriteArray(data[yoff:yoff + block_y, xoff:xoff + block_x], xoff, yoff)
     band.SetNoDataValue(nodata_val)
 
     # Close file
     dataset = None
 
 
-def reproject_to_template(input_raster, template_raster, output_raster, resolution=None,
-                          resampling=gdal.GRA_Bilinear, nodata_val=0):
+def reproject_to_template(input_raster, template_raster, output_raster=None, resolution=None,
+                          resampling=gdal.GRA_Bilinear, nodata_val=0, warp_memory_mb=1024):
     """
     Reprojects a raster to match the extent, cell size, projection and dimensions of a template
     raster using GDAL. Optionally, can set custom resolution for output reprojected raster using
@@ -561,10 +930,12 @@ def reproject_to_template(input_raster, template_raster, output_raster, resoluti
         Path to input geotiff raster to be reprojected (.tif)
 
     :param template_raster:
-        Path to template geotiff raster (.tif) used to copy extent, projection etc
+        Path to template geotiff raster (.tif) used to copy extent, projection etc, or an already
+        open GDAL dataset (which avoids re-opening the template for every reprojection)
 
     :param output_raster:
-        Output reprojected raster path with geotiff extension (.tif)
+        Optional output reprojected raster path with geotiff extension (.tif). Defaults to None,
+        which creates the reprojected raster in memory without writing it to disk
 
     :param resolution:
         Optionally set custom cell size for output reprojected raster; defaults to
@@ -576,6 +947,10 @@ def reproject_to_template(input_raster, template_raster, output_raster, resoluti
     :param nodata_val:
         Values in the output reprojected raster to set to nodata; defaults to 0
 
+    :param warp_memory_mb:
+        Amount of memory (in MB) the GDAL warper can use for each chunk of the output raster;
+        defaults to 1024
+
     :return:
         GDAL dataset for further analysis, and raster written to output_raster (if this
         dataset appears empty when loaded into a GIS, close the dataset like 'output_ds = None')
@@ -583,51 +958,325 @@ def reproject_to_template(input_raster, template_raster, output_raster, resoluti
     """
 
     # Import raster to reproject
-    print("Importing raster datasets")
+    logger.debug("Importing raster datasets")
     input_ds = gdal.Open(input_raster)
-    input_proj = input_ds.GetProjection()
-    input_geotrans = input_ds.GetGeoTransform()
-    data_type = input_ds.GetRasterBand(1).DataType
-    n_bands = input_ds.RasterCount
 
-    # Import raster to use as template
-    template_ds = gdal.Open(template_raster)
+    # Import raster to use as template, unless an already open dataset is supplied
+    template_ds = gdal.Open(template_raster) if isinstance(template_raster, str) else template_raster
     template_proj = template_ds.GetProjection()
     template_geotrans = template_ds.GetGeoTransform()
     template_w = template_ds.RasterXSize
     template_h = template_ds.RasterYSize
 
-    # Use custom resolution if supplied
-    if resolution:
-        template_geotrans[1] = float(resolution)
-        template_geotrans[-1] = -float(resolution)
-
-    # Create new output dataset to reproject into
-    output_ds = gdal.GetDriverByName('Gtiff').Create(output_raster, template_w,
-                                                     template_h, n_bands, data_type)
-    output_ds.SetGeoTransform(template_geotrans)
-    output_ds.SetProjection(template_proj)
-    output_ds.GetRasterBand(1).SetNoDataValue(nodata_val)
+    # Compute output bounds (min x, min y, max x, max y) from template raster
+    upleft_x, x_size, _, upleft_y, _, y_size = template_geotrans
+    output_bounds = (upleft_x, upleft_y + y_size * template_h, upleft_x + x_size * template_w, upleft_y)
 
-    # Reproject raster into output dataset
-    print("Reprojecting raster")
-    gdal.ReprojectImage(input_ds, output_ds, input_proj, template_proj, resampling)
+    # Use custom resolution if supplied, otherwise match dimensions of template raster
+    if resolution:
+        output_size = dict(xRes=float(resolution), yRes=float(resolution))
+    else:
+        output_size = dict(width=template_w, height=template_h)
+
+    # Reproject raster into output dataset, either in memory or on disk. Output pixels are initialised
+    # to 0 rather than nodata, so pixels with no valid input data are assigned 0. Reading input data and
+    # warping are overlapped in separate threads, and the warp itself is computed using all available CPUs
+    logger.debug("Reprojecting raster")
+    output_ds = gdal.Warp(output_raster if output_raster else '',
+                          input_ds,
+                          format='GTiff' if output_raster else 'MEM',
+                          outputBounds=output_bounds,
+                          dstSRS=template_proj,
+                          resampleAlg=resampling,
+                          dstNodata=nodata_val,
+                          warpOptions=['INIT_DEST=0', f'NUM_THREADS={gdal_threads}'],
+                          multithread=True,
+                          warpMemoryLimit=warp_memory_mb,
+                          **output_size)
 
     # Close datasets
     input_ds = None
     template_ds = None
 
-    print("Reprojected raster exported to {}".format(output_raster))
+    if output_raster:
+        logger.info("Reprojected raster exported to %s", output_raster)
+
     return output_ds
 
 
+# Marching squares lookup table giving the edges crossed by each contour segment for each of the 16 possible
+# cases of a 2 x 2 pixel square (where case = ul > level + 2 * (ur > level) + 4 * (ll > level) + 8 * (lr > level)).
+# Each row gives the (from, to) edges of up to two segments, where 0 = top, 1 = bottom, 2 = left, 3 = right and -1
+# = no segment. Ambiguous saddle cases (6 and 9) connect low-valued pixels, and segments are oriented so that
+# values lower than the contour are to the left. This matches `skimage.measure.find_contours` defaults.
+MARCHING_SQUARES_EDGES = np.array([(-1, -1, -1, -1), (0, 2, -1, -1), (3, 0, -1, -1), (3, 2, -1, -1),
+                                   (2, 1, -1, -1), (0, 1, -1, -1), (3, 0, 2, 1), (3, 1, -1, -1),
+                                   (1, 3, -1, -1), (0, 2, 1, 3), (1, 0, -1, -1), (1, 2, -1, -1),
+                                   (2, 3, -1, -1), (0, 3, -1, -1), (2, 0, -1, -1), (-1, -1, -1, -1)])
+
+
+@njit(cache=True)
+def square_case(ul, ur, ll, lr, level):
+
+    """
+    Identifies the marching squares case of a 2 x 2 pixel square from the pixel values that are above a contour
+    level. Returns -1 for squares containing NaN pixels, which are skipped so contours stop at the edge of nodata.
+
+    """
+
+    if np.isnan(ul) or np.isnan(ur) or np.isnan(ll) or np.isnan(lr):
+        return -1
+
+    return (ul > level) + 2 * (ur > level) + 4 * (ll > level) + 8 * (lr > level)
+
+
+@njit(parallel=True, cache=True)
+def multi_contour_segments(arr, levels):
+
+    """
+    Uses marching squares to extract contour line segments for multiple contour levels in a single pass over a
+    two-dimensional array. Each 2 x 2 pixel square is read once and tested against every contour level. Squares
+    containing NaN pixels are skipped, so contours stop at the edge of nodata pixels.
+
+    Rows of squares are processed in parallel in two passes: the first counts the segments in each row, which
+    gives the position in the output arrays where each row's segments are written by the second pass. This keeps
+    the output in the same order as a serial scan.
+
+    :param arr:
+        A two-dimensional array from which contour segments are extracted.
+
+    :param levels:
+        A one-dimensional float array of contour levels.
+
+    :return:
+        An array of shape (n, 4) giving the (from_row, from_col, to_row, to_col) coordinates of each contour
+        segment in pixel units, and an array of shape (n,) giving the index of the contour level of each segment.
+        Segments for each level are ordered by the row then column of the square they were extracted from.
+
+    """
+
+    rows, cols = arr.shape
+    row_counts = np.zeros(max(rows - 1, 0), dtype=np.int64)
+
+    # First pass: count the segments produced by each row of squares
+    for r0 in prange(rows - 1):
+        count = 0
+
+        for c0 in range(cols - 1):
+            for k in range(levels.shape[0]):
+                case = square_case(arr[r0, c0], arr[r0, c0 + 1], arr[r0 + 1, c0], arr[r0 + 1, c0 + 1], levels[k])
+                if case > 0:
+                    count += (MARCHING_SQUARES_EDGES[case, 0] >= 0) + (MARCHING_SQUARES_EDGES[case, 2] >= 0)
+
+        row_counts[r0] = count
+
+    # Compute the position of the first segment of each row in the output arrays
+    row_offsets = np.zeros(row_counts.shape[0] + 1, dtype=np.int64)
+    row_offsets[1:] = np.cumsum(row_counts)
+    segments = np.empty((row_offsets[-1], 4))
+    segment_levels = np.empty(row_offsets[-1], dtype=np.int64)
+
+    # Second pass: compute and write the segments for each row of squares
+    for r0 in prange(rows - 1):
+        r1 = r0 + 1
+        edge_coords = np.empty((4, 2))
+        n = row_offsets[r0]
+
+        for c0 in range(cols - 1):
+            c1 = c0 + 1
+
+            # Read values of each pixel in square
+            ul = arr[r0, c0]
+            ur = arr[r0, c1]
+            ll = arr[r1, c0]
+            lr = arr[r1, c1]
+
+            for k in range(levels.shape[0]):
+                level = levels[k]
+
+                # Identify marching squares case from values above contour level
+                case = square_case(ul, ur, ll, lr, level)
+                if case <= 0 or case == 15:
+                    continue
+
+                # Linearly interpolate position of contour along each edge of square
+                edge_coords[0, 0] = r0
+                edge_coords[0, 1] = c0 + (0.0 if ur == ul else (level - ul) / (ur - ul))
+                edge_coords[1, 0] = r1
+                edge_coords[1, 1] = c0 + (0.0 if lr == ll else (level - ll) / (lr - ll))
+                edge_coords[2, 0] = r0 + (0.0 if ll == ul else (level - ul) / (ll - ul))
+                edge_coords[2, 1] = c0
+                edge_coords[3, 0] = r0 + (0.0 if lr == ur else (level - ur) / (lr - ur))
+                edge_coords[3, 1] = c1
+
+                # Add segments for case
+                for j in range(0, 4, 2):
+                    from_edge = MARCHING_SQUARES_EDGES[case, j]
+                    to_edge = MARCHING_SQUARES_EDGES[case, j + 1]
+
+                    if from_edge >= 0:
+                        segments[n, 0] = edge_coords[from_edge, 0]
+                        segments[n, 1] = edge_coords[from_edge, 1]
+                        segments[n, 2] = edge_coords[to_edge, 0]
+                        segments[n, 3] = edge_coords[to_edge, 1]
+                        segment_levels[n] = k
+                        n += 1
+
+    return segments, segment_levels
+
+
+@njit(cache=True)
+def nan_range(arr):
+
+    """
+    Computes the minimum and maximum of the non-NaN values in an array in a single pass. Returns (inf, -inf) if the
+    array contains no valid values.
+
+    """
+
+    lo = np.inf
+    hi = -np.inf
+
+    for value in arr.ravel():
+        if value < lo:
+            lo = value
+        if value > hi:
+            hi = value
+
+    return lo, hi
+
+
+def assemble_contours(segments):
+
+    """
+    Joins contour line segments that share end points into continuous contour lines. Contours are returned in
+    the order their first segment was extracted, which matches the output of `skimage.measure.find_contours`.
+
+    :param segments:
+        An array of shape (n, 4) giving the (from_row, from_col, to_row, to_col) coordinates of each segment.
+
+    :return:
+        A list of arrays of shape (m, 2) giving the (row, col) coordinates of each contour.
+
+    """
+
+    contours = {}
+    starts = {}
+    ends = {}
+    contour_num = 0
+
+    for from_row, from_col, to_row, to_col in segments.tolist():
+
+        from_point = (from_row, from_col)
+        to_point = (to_row, to_col)
+
+        # Ignore degenerate segments where a pixel is exactly equal to the contour level; these are
+        # picked up by neighbouring squares
+        if from_point == to_point:
+            continue
+
+        # Identify any existing contours that the segment connects to
+        tail, tail_num = starts.pop(to_point, (None, None))
+        head, head_num = ends.pop(from_point, (None, None))
+
+        if tail is not None and head is not None:
+
+            # Segment closes a contour
+            if tail is head:
+                head.append(to_point)
+
+            # Segment joins two contours; keep the contour created first
+            elif tail_num > head_num:
+                head.extend(tail)
+                contours.pop(tail_num)
+                starts[head[0]] = (head, head_num)
+                ends[head[-1]] = (head, head_num)
+
+            else:
+                tail.extendleft(reversed(head))
+                starts.pop(head[0], None)
+                contours.pop(head_num)
+                starts[tail[0]] = (tail, tail_num)
+                ends[tail[-1]] = (tail, tail_num)
+
+        # Segment starts a new contour
+        elif tail is None and head is None:
+            contour = collections.deque((from_point, to_point))
+            contours[contour_num] = contour
+            starts[from_point] = (contour, contour_num)
+            ends[to_point] = (contour, contour_num)
+            contour_num += 1
+
+        # Segment is prepended to the start of a contour
+        elif head is None:
+            tail.appendleft(from_point)
+            starts[from_point] = (tail, tail_num)
+
+        # Segment is appended to the end of a contour
+        else:
+            head.append(to_point)
+            ends[to_point] = (head, head_num)
+
+    return [np.array(contour) for _, contour in sorted(contours.items())]
+
+
+def multi_contour(arr, levels, max_workers=None):
+
+    """
+    Extracts contour lines for multiple contour levels from a two-dimensional array. This produces equivalent
+    output to calling `skimage.measure.find_contours` once for each level, but reads the array in a single
+    pass using `multi_contour_segments`. Segments for each level are then joined into contour lines; as this is
+    pure Python, levels can optionally be joined in parallel in separate processes.
+
+    :param arr:
+        A two-dimensional array from which contours are extracted.
+
+    :param levels:
+        A list of numeric contour values to extract from the array.
+
+    :param max_workers:
+        An optional integer giving the maximum number of worker processes used to join segments into contour lines
+        for each level in parallel. Defaults to None, which joins segments for all levels in the current process.
+
+    :return:
+        A dictionary with contour levels as the dict key, and a list of arrays of shape (m, 2) giving the
+        (row, col) coordinates of each contour as dict values.
+
+    """
+
+    arr = np.asarray(arr)
+    levels_array = np.asarray(levels, dtype=np.float64)
+
+    # Only levels within the range of valid values in the array can produce contours, so other levels are skipped
+    lo, hi = nan_range(arr)
+    in_range = np.flatnonzero((levels_array >= lo) & (levels_array <= hi))
+
+    segments, segment_levels = multi_contour_segments(arr, levels_array[in_range])
+    level_segments = [np.empty((0, 4)) for _ in levels]
+    for i, level_index in enumerate(in_range):
+        level_segments[level_index] = segments[segment_levels == i]
+
+    # Only the segments for each level (not the full array) need to be sent to worker processes. Workers are
+    # started with 'spawn' rather than 'fork', as forking after Numba has started its threading layer can deadlock
+    if max_workers and max_workers > 1 and len(levels) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(max_workers, len(levels)),
+                                                    mp_context=multiprocessing.get_context('spawn')) as executor:
+            level_contours = list(executor.map(assemble_contours, level_segments))
+
+    else:
+        level_contours = [assemble_contours(i) for i in level_segments]
+
+    return collections.OrderedDict(zip(levels, level_contours))
+
+
 def contour_extract(z_values, ds_array, ds_crs, ds_affine, output_shp=None, min_vertices=2,
-                    attribute_data=None, attribute_dtypes=None):
+                    attribute_data=None, attribute_dtypes=None, max_workers=None):
 
     """
-    Uses `skimage.measure.find_contours` to extract contour lines from a two-dimensional array.
-    Contours are extracted as a dictionary of xy point arrays for each contour z-value, and optionally as
-    line shapefile with one feature per contour z-value.
+    Uses marching squares (see `multi_contour`) to extract contour lines from a two-dimensional array. This
+    produces equivalent output to `skimage.measure.find_contours`, but extracts every contour z-value in a
+    single pass over the array. Contours are extracted as a dictionary of xy point arrays for each contour z-value,
+    and optionally as line shapefile with one feature per contour z-value.
 
     The `attribute_data` and `attribute_dtypes` parameters can be used to pass custom attributes to the output
     shapefile.
@@ -641,7 +1290,9 @@ def contour_extract(z_values, ds_array, ds_crs, ds_affine, output_shp=None, min_
     :param ds_array:
         A two-dimensional array from which contours are extracted. This can be a numpy array or xarray DataArray.
         If an xarray DataArray is used, ensure that the array has one two dimensions (e.g. remove the time dimension
-        using either `.isel(time=0)` or `.squeeze('time')`).
+        using either `.isel(time=0)` or `.squeeze('time')`). Float64 arrays are converted to float32 before
+        extracting contours, which halves the memory read by marching squares with negligible effect on contour
+        positions for elevation data.
 
     :param ds_crs:
         Either a EPSG string giving the coordinate system of the array (e.g. 'EPSG:3577'), or a crs
@@ -675,6 +1326,10 @@ def contour_extract(z_values, ds_array, ds_crs, ds_affine, output_shp=None, min_
         Valid values include 'int', 'str', 'datetime, and 'float:X.Y', where X is the minimum number of characters
         before the decimal place, and Y is the number of characters after the decimal place.
 
+    :param max_workers:
+        An optional integer giving the maximum number of worker processes used to join contour segments into
+        lines for each z-value in parallel (see `multi_contour`). Defaults to None, which uses the current process.
+
     :return:
         A dictionary with contour z-values as the dict key, and a list of xy point arrays as dict values.
 
@@ -683,11 +1338,22 @@ def contour_extract(z_values, ds_array, ds_crs, ds_affine, output_shp=None, min_
     # First test that input array has only two dimensions:
     if len(ds_array.shape) == 2:
 
+        # Extract numpy array from xarray DataArrays, and convert float64 data to float32
+        ds_array = np.asarray(getattr(ds_array, 'values', ds_array))
+        if ds_array.dtype == np.float64:
+            ds_array = ds_array.astype(np.float32)
+
         # Obtain affine object from either rasterio/xarray affine or a gdal geotransform:
-        if type(ds_affine) != affine.Affine:
+        if not isinstance(ds_affine, affine.Affine):
 
             ds_affine = affine.Affine.from_gdal(*ds_affine)
 
+        # Extract affine coefficients used to convert pixel coordinates into real world coordinates as plain floats,
+        # and compute the half pixel offset used to shift coordinates to the centre of pixels
+        a, b, xoff, d, e, yoff = (float(i) for i in (ds_affine.a, ds_affine.b, ds_affine.xoff,
+                                                     ds_affine.d, ds_affine.e, ds_affine.yoff))
+        half_pixel = 0.5 * a
+
         ####################
         # Extract contours #
         ####################
@@ -695,27 +1361,51 @@ def contour_extract(z_values, ds_array, ds_crs, ds_affine, output_shp=None, min_
         # Output dict to hold contours for each offset
         contours_dict = collections.OrderedDict()
 
-        for z_value in z_values:
-
-            # Extract contours and convert output array pixel coordinates into arrays of real world Albers coordinates.
-            # We need to add (0.5 x the pixel size) to x values and subtract (-0.5 * pixel size) from y values to
-            # correct coordinates to give the centre point of pixels, rather than the top-left corner
-            print(f'Extracting contour {z_value}')
-            ps = ds_affine[0]  # Compute pixel size
-            contours_geo = [np.column_stack(ds_affine * (i[:, 1], i[:, 0])) + np.array([0.5 * ps, -0.5 * ps]) for i in
-                            find_contours(ds_array, z_value)]
-
-            # For each array of coordinates, drop any xy points that have NA
-            contours_nona = [i[~np.isnan(i).any(axis=1)] for i in contours_geo]
-
-            # Drop 0 length and add list of contour arrays to dict
-            contours_withdata = [i for i in contours_nona if len(i) >= min_vertices]
+        # Extract contours for all z-values in pixel coordinates
+        contours_pixel = multi_contour(ds_array, z_values, max_workers=max_workers)
+
+        for z_value, contours in contours_pixel.items():
+
+            logger.debug('Extracting contour %s', z_value)
+            contours_withdata = []
+
+            if contours:
+
+                # Convert output array pixel coordinates into arrays of real world Albers coordinates. All vertices
+                # for the contour z-value are transformed at once, rather than separately for each contour line.
+                # We need to add (0.5 x the pixel size) to x values and subtract (-0.5 * pixel size) from y values
+                # to correct coordinates to give the centre point of pixels, rather than the top-left corner.
+                # Coordinates are computed in place in a single output array, avoiding intermediate arrays
+                lengths = np.fromiter((len(i) for i in contours), dtype=np.intp, count=len(contours))
+                all_pts = np.concatenate(contours, axis=0)
+                contours_geo = np.empty_like(all_pts)
+                x, y = contours_geo[:, 0], contours_geo[:, 1]
+                np.multiply(all_pts[:, 1], a, out=x)
+                x += b * all_pts[:, 0]
+                x += xoff
+                x += half_pixel
+                np.multiply(all_pts[:, 1], d, out=y)
+                y += e * all_pts[:, 0]
+                y += yoff
+                y -= half_pixel
+
+                # Drop any xy points that have NA (only copying coordinates if required), then count the points
+                # remaining in each contour line
+                valid = ~(np.isnan(x) | np.isnan(y))
+                if not valid.all():
+                    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+                    lengths = np.add.reduceat(valid.astype(np.intp), starts)
+                    contours_geo = contours_geo[valid]
+
+                # Split back into individual contour lines, and drop lines with fewer than `min_vertices` points
+                contours_withdata = [i for i, n in zip(np.split(contours_geo, np.cumsum(lengths)[:-1]), lengths)
+                                     if n >= min_vertices]
 
             # If there is data for the contour, add to dict:
             if len(contours_withdata) > 0:
                 contours_dict[z_value] = contours_withdata
             else:
-                print(f'    No data for contour {z_value}; skipping')
+                logger.info('No data for contour %s; skipping', z_value)
 
         #######################
         # Export to shapefile #
@@ -724,7 +1414,7 @@ def contour_extract(z_values, ds_array, ds_crs, ds_affine, output_shp=None, min_
         # If a shapefile path is given, generate shapefile
         if output_shp:
 
-            print(f'\nExporting contour shapefile to {output_shp}')
+            logger.info('Exporting contour shapefile to %s', output_shp)
 
             # If attribute fields are left empty, default to including a single z-value field based on `z_values`
             if not attribute_data:
@@ -737,31 +1427,31 @@ def contour_extract(z_values, ds_array, ds_crs, ds_affine, output_shp=None, min_
             schema = {'geometry': 'MultiLineString',
                       'properties': attribute_dtypes}
 
-            # Create output shapefile for writing
+            # Set up output coordinate system as WKT. This accepts either EPSG strings or crs objects, and avoids
+            # the deprecated `{'init': ...}` crs dictionaries
+            srs = osr.SpatialReference()
+            srs.SetFromUserInput(str(ds_crs))
+
+            # Create a feature for each contour z-value, using a multi-string object from all contour coordinates and
+            # attribute values for the z-value
+            records = [{'properties': {field_name: field_vals[i] for field_name, field_vals in attribute_data.items()},
+                        'geometry': mapping(MultiLineString(contours))}
+                       for i, contours in enumerate(contours_dict.values())]
+
+            # Create output shapefile and write all features to file at once
             with fiona.open(output_shp, 'w',
-                            crs={'init': str(ds_crs), 'no_defs': True},
+                            crs_wkt=srs.ExportToWkt(),
                             driver='ESRI Shapefile',
                             schema=schema) as output:
 
-                # Write each shapefile to the dataset one by one
-                for i, (z_value, contours) in enumerate(contours_dict.items()):
-
-                    # Create multi-string object from all contour coordinates
-                    contour_multilinestring = MultiLineString(contours)
-
-                    # Get attribute values for writing
-                    attribute_vals = {field_name: field_vals[i] for field_name, field_vals in attribute_data.items()}
-
-                    # Write output shapefile to file with z-value field
-                    output.write({'properties': attribute_vals,
-                                  'geometry': mapping(contour_multilinestring)})
+                output.writerecords(records)
 
         # Return dict of contour arrays
         return contours_dict
 
     else:
-        print(f'The input `ds_array` has shape {ds_array.shape}. Please input a two-dimensional array (if your '
-              f'input array has a time dimension, remove it using `.isel(time=0)` or `.squeeze(\'time\')`)')
+        logger.error('The input `ds_array` has shape %s. Please input a two-dimensional array (if your input array '
+                     'has a time dimension, remove it using `.isel(time=0)` or `.squeeze(\'time\')`)', ds_array.shape)
 
 
 def interval_uncertainty(polygon_id, item_polygon_path,
@@ -799,35 +1489,159 @@ def interval_uncertainty(polygon_id, item_polygon_path,
 
     """
 
+    # Identify observations for the polygon, then model tides and compute uncertainty for each interval
+    observations = observation_times(polygon_id=polygon_id, item_polygon_path=item_polygon_path,
+                                     products=products, time_period=time_period)
+    tides_obs, = model_tides([observations])
+
+    return interval_std(tides_obs)
+
+
+def batch_interval_uncertainty(polygon_ids, item_polygon_path,
+                               products=('ls5_pq_albers', 'ls7_pq_albers', 'ls8_pq_albers'),
+                               time_period=('1986-01-01', '2017-01-01')):
+
+    """
+    Computes the same tidal interval uncertainties as `interval_uncertainty` for multiple ITEM v2.0 polygons.
+    Observations are first identified for every polygon, then tides for all polygons are modelled using a single
+    call to the tidal model, avoiding the fixed cost of running the model separately for each polygon. Polygons for
+    which observations cannot be identified are logged and left out of the output.
+
+    :param polygon_ids:
+        A list of integer polygon IDs of the ITEM v2.0 polygons to analyse.
+
+    :param item_polygon_path:
+        A string giving the path to the ITEM v2.0 polygon shapefile.
+
+    :param products:
+        An optional tuple of DEA Landsat product names; see `interval_uncertainty`.
+
+    :param time_period:
+        An optional tuple giving the start and end date to analyse; see `interval_uncertainty`.
+
+    :return:
+        A dictionary with polygon IDs as dict keys, and arrays of shape (9,) giving the standard deviation of tidal
+        heights for each ITEM interval as dict values.
+
+    """
+
+    observations = collections.OrderedDict()
+
+    for polygon_id in polygon_ids:
+
+        try:
+            observations[polygon_id] = observation_times(polygon_id=polygon_id, item_polygon_path=item_polygon_path,
+                                                         products=products, time_period=time_period)
+
+        except Exception as e:
+            logger.error('Failed to identify observations for polygon %s: %s', polygon_id, e)
+
+    all_tides_obs = model_tides(list(observations.values()))
+
+    return {polygon_id: interval_std(tides_obs) for polygon_id, tides_obs in zip(observations, all_tides_obs)}
+
+
+@functools.lru_cache(maxsize=None)
+def read_item_polygons(item_polygon_path):
+
+    """
+    Reads the ITEM v2.0 polygon shapefile. The result is cached, so the shapefile is only read once per process.
+
+    """
+
+    import geopandas as gpd
+
+    return gpd.read_file(item_polygon_path)
+
+
+def observation_times(polygon_id, item_polygon_path, products, time_period):
+
+    """
+    Identifies the location of the tide post and the times of all Landsat observations used to generate the ITEM
+    v2.0 composite layers for a polygon (see `interval_uncertainty` for parameters).
+
+    :return:
+        A tuple of the longitude and latitude of the polygon's tide post, and a sorted list of observation times.
+
+    """
+
+    from datacube.utils import geometry
+    from datacube.api.query import query_group_by
+
+    dc = get_datacube()
+
     # Import tidal model data and extract geom and tide post
-    item_gpd = gpd.read_file(item_polygon_path)
+    item_gpd = read_item_polygons(item_polygon_path)
     lat, lon, poly = item_gpd[item_gpd.ID == int(polygon_id)][['lat', 'lon', 'geometry']].values[0]
     geom = geometry.Geometry(mapping(poly), crs=geometry.CRS(item_gpd.crs['init']))
 
     all_times_obs = list()
 
+    # Datasets are grouped into solar days separately for each product, so observations from different sensors on
+    # the same day are kept as separate observations
+    group_by = query_group_by(group_by='solar_day')
+
     # For each product:
     for source in products:
 
         # Use entire time range unless LS7
         time_range = ('1986-01-01', '2003-05-01') if source == 'ls7_pq_albers' else time_period
 
-        # Determine matching datasets for geom area and group into solar day
+        # Determine matching datasets for geom area
         ds = dc.find_datasets(product=source, time=time_range, geopolygon=geom)
-        group_by = query_group_by(group_by='solar_day')
-        sources = dc.group_datasets(ds, group_by)
 
-        # If data is found, add time to list then sort
+        # If data is found, group into solar day and add time to list then sort
         if len(ds) > 0:
+            sources = dc.group_datasets(ds, group_by)
             all_times_obs.extend(sources.time.data.astype('M8[s]').astype('O').tolist())
 
-    # Calculate tide data from X-Y-time location
-    all_times_obs = sorted(all_times_obs)
-    tp_obs = [TimePoint(float(lon), float(lat), dt) for dt in all_times_obs]
-    tides_obs = [tide.tide_m for tide in predict_tide(tp_obs)]
+    logger.info('Found %s Landsat observations for polygon %s', len(all_times_obs), polygon_id)
+
+    return float(lon), float(lat), sorted(all_times_obs)
 
-    # Covert to dataframe of observed dates and tidal heights
-    df1_obs = pd.DataFrame({'Tide_height': tides_obs}, index=pd.DatetimeIndex(all_times_obs))
+
+def model_tides(observations):
+
+    """
+    Models tide heights for one or more sets of observations using a single call to the tidal model. Tides are only
+    modelled once for each unique location and time, then broadcast back to every observation.
+
+    :param observations:
+        A list of (lon, lat, times) tuples, each giving the location of a tide post and a list of observation times.
+
+    :return:
+        A list of lists of tide heights with one value for every observation time in each set of observations.
+
+    """
+
+    from otps import TimePoint, predict_tide
+
+    # Calculate tide data from X-Y-time location for all unique locations and times
+    unique_obs = sorted({(lon, lat, dt) for lon, lat, times in observations for dt in times})
+    tp_obs = [TimePoint(lon, lat, dt) for lon, lat, dt in unique_obs]
+    unique_tides_obs = dict(zip(unique_obs, [tide.tide_m for tide in predict_tide(tp_obs)])) if tp_obs else {}
+
+    return [[unique_tides_obs[(lon, lat, dt)] for dt in times] for lon, lat, times in observations]
+
+
+def interval_std(tides_obs):
+
+    """
+    Computes the standard deviation of tide heights in each of the nine ITEM intervals, which divide the observed
+    range of tide heights into equal tenths (see `interval_uncertainty`).
+
+    :param tides_obs:
+        A list of tide heights for every observation.
+
+    :return:
+        An array of shape (9,) giving the standard deviation of tide heights in each ITEM interval.
+
+    """
+
+    import pandas as pd
+
+    # Covert to dataframe of tidal heights
+    df1_obs = pd.DataFrame({'Tide_height': tides_obs}, dtype=np.float64)
 
 
     ##################
@@ -842,13 +1656,178 @@ def interval_uncertainty(polygon_id, item_polygon_path,
     # Create dict of percentile values
     per10_dict = {perc + 1: min_height + observed_range * perc * 0.1 for perc in range(0, 10, 1)}
 
-    # Bin each observation into an interval
-    df1_obs['interval'] = pd.cut(df1_obs.Tide_height,
-                                 bins=list(per10_dict.values()),
-                                 labels=list(per10_dict.keys())[:-1])
+    # Bin each observation into an interval, giving integer interval codes from 0 to 8 (observations that fall
+    # outside all intervals are assigned NaN)
+    codes = pd.cut(df1_obs.Tide_height, bins=list(per10_dict.values()), labels=False).to_numpy()
+    binned = ~np.isnan(codes)
+    codes = codes[binned].astype(np.intp)
+    tides = df1_obs.Tide_height.to_numpy(dtype=np.float64)[binned]
+
+    # Compute the sample standard deviation of tide heights in each interval from per-interval sums; intervals
+    # with fewer than two observations are assigned NaN
+    n_intervals = len(per10_dict) - 1
+    counts = np.bincount(codes, minlength=n_intervals)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.bincount(codes, weights=tides, minlength=n_intervals) / counts
+        sq_dev = np.bincount(codes, weights=(tides - means[codes]) ** 2, minlength=n_intervals)
+        return np.where(counts > 1, np.sqrt(sq_dev / (counts - 1)), np.nan)
+
+
+def get_datacube():
+
+    """
+    Returns a connection to the datacube, connecting on first use. The connection is re-used for all subsequent
+    calls within the same process.
+
+    :return:
+        A `datacube.Datacube` instance.
+
+    """
+
+    global dc
+
+    if dc is None:
+        import datacube
+        dc = datacube.Datacube(app='NIDEM generation')
+
+    return dc
+
+
+def close_datacube():
+
+    """
+    Closes the datacube connection opened by `get_datacube`, if any. This is used before starting worker processes
+    so that they do not inherit an open database connection.
+
+    """
+
+    global dc
+
+    if dc is not None:
+        dc.close()
+        dc = None
+
+
+def init_worker(numba_threads=None):
+
+    """
+    Initialises a process used to generate NIDEM datasets by importing configuration details from
+    NIDEM_configuration.ini. This is used as the initializer for each worker process in `run_batch`, so this
+    fixed cost is paid once per process rather than once per polygon. The datacube connection is opened on
+    first use by `get_datacube`.
+
+    :param numba_threads:
+        An optional integer giving the number of threads used by Numba-accelerated functions and GDAL compression
+        and warping in this process. Defaults to None, which uses all available CPUs.
 
-    return df1_obs.groupby('interval').std().values.flatten()
+    """
+
+    global config, gdal_threads
+
+    # Import configuration details from NIDEM_configuration.ini
+    config = configparser.ConfigParser()
+    config.read('NIDEM_configuration.ini')
+
+    # Limit Numba and GDAL threads to the CPUs allocated to this process, to avoid oversubscribing CPUs when
+    # running multiple processes or when a job has been allocated only part of a node
+    if numba_threads:
+        set_num_threads(min(numba_threads, numba.config.NUMBA_NUM_THREADS))
+        gdal_threads = str(numba_threads)
+
+
+def run_batch(polygon_ids, max_workers=None):
+
+    """
+    Generates NIDEM datasets for multiple ITEM v2.0 polygons in parallel using a pool of worker processes.
+    A failure in one polygon does not stop the remaining polygons from being processed. Tidal uncertainties for
+    all polygons are computed up front in the parent process (see `batch_interval_uncertainty`).
+
+    :param polygon_ids:
+        A list of integer ITEM v2.0 polygon IDs to process.
+
+    :param max_workers:
+        An optional integer giving the maximum number of worker processes. Defaults to None, which uses the
+        number of CPUs allocated to the PBS job (the `NCPUS` environment variable) if available, or otherwise
+        the number of CPUs on the machine.
+
+    """
+
+    # Identify number of CPUs available, and split them between worker processes
+    n_cpus = int(os.environ.get('NCPUS', os.cpu_count()))
+    max_workers = min(max_workers or n_cpus, len(polygon_ids))
+    numba_threads = max(1, n_cpus // max_workers)
+
+    failed_ids = []
+
+    # Compute uncertainties for all polygons in this process before starting workers, so tides for every polygon
+    # are modelled in a single batch. If this fails, each worker computes uncertainties for its own polygon.
+    # Only configuration details are loaded here: setting a Numba thread count would start Numba's threading
+    # layer, which deadlocks or crashes the worker processes forked from this process below
+    init_worker()
+    try:
+        uncertainties = batch_interval_uncertainty(polygon_ids, config['ITEM inputs']['item_polygon_path'])
+    except Exception as e:
+        logger.error('Failed to compute batch uncertainties: %s', e)
+        uncertainties = {}
+    finally:
+        close_datacube()
+
+    # Optionally thin contour vertices before interpolation (disabled by default; see NIDEM_configuration.ini)
+    decimation_pixels = config.getint('Processing options', 'decimation_pixels', fallback=0) or None
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers,
+                                                initializer=init_worker,
+                                                initargs=(numba_threads,)) as executor:
+
+        # Submit each polygon for processing, and report results as each polygon finishes
+        futures = {executor.submit(process_polygon, polygon_id, decimation_pixels=decimation_pixels,
+                                   uncertainty_array=uncertainties.get(polygon_id)): polygon_id
+                   for polygon_id in polygon_ids}
+
+        for future in concurrent.futures.as_completed(futures):
+
+            polygon_id = futures[future]
+
+            try:
+                future.result()
+                logger.info('Finished polygon %s', polygon_id)
+
+            except Exception as e:
+                logger.error('Failed polygon %s: %s', polygon_id, e)
+                failed_ids.append(polygon_id)
+
+    if failed_ids:
+        sys.exit('Failed to process polygons: {}'.format(' '.join(str(i) for i in sorted(failed_ids))))
+
+
+def main(argv=None):
+
+    if argv is None:
+
+        argv = sys.argv
+        logger.debug(sys.argv)
+
+    # If no user arguments provided
+    if len(argv) < 2:
+
+        str_usage = "You must specify one or more polygon IDs"
+        logger.error(str_usage)
+        sys.exit(1)
+
+    # Set ITEM polygons for analysis
+    polygon_ids = [int(polygon_id) for polygon_id in argv[1:]]  # polygon_ids = [33]
+
+    # Process a single polygon directly in this process, or multiple polygons in parallel
+    if len(polygon_ids) == 1:
+        n_cpus = int(os.environ.get('NCPUS', os.cpu_count()))
+        init_worker(numba_threads=n_cpus)
+        decimation_pixels = config.getint('Processing options', 'decimation_pixels', fallback=0) or None
+        process_polygon(polygon_ids[0], decimation_pixels=decimation_pixels, contour_workers=n_cpus)
+
+    else:
+        run_batch(polygon_ids)
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(processName)s %(levelname)s: %(message)s')
     main()
@@ -0,0 +1,2 @@
+# Placing this file in the repository root makes pytest add the root to sys.path, so the tests in
+# tests/ can import NIDEM_generation when pytest is run directly
@@ -12,9 +12,34 @@
 
 import os
 import math
+import logging
 import itertools
+import functools
 import pandas as pd
-from pyproj import Proj, transform
+import pyarrow.csv as pacsv
+
+# Only use PROJ grids available locally, rather than searching for grids on the PROJ content delivery network.
+# This is set before importing pyproj so it applies to every PROJ context
+os.environ.setdefault('PROJ_NETWORK', 'OFF')
+from pyproj import Transformer
+
+# Report progress using a logger rather than printing directly to stdout
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+logger = logging.getLogger(__name__)
+
+
+@functools.lru_cache(maxsize=None)
+def get_transformer(src_crs, dst_crs):
+    """
+    Creates a coordinate transformer between two coordinate reference systems. Transformers are cached,
+    so the PROJ database is only queried once for each pair of coordinate reference systems.
+
+    :param src_crs: Source coordinate reference system (e.g. 'EPSG:28355')
+    :param dst_crs: Destination coordinate reference system (e.g. 'EPSG:4326')
+    :return: pyproj Transformer returning coordinates in x-y (e.g. lon-lat) order
+    """
+
+    return Transformer.from_crs(src_crs, dst_crs, always_xy=True)
 
 
 #########
@@ -26,6 +51,9 @@ os.chdir('C:/Users/u69654/Projects/nidem-GA/')
 study_areas_df = pd.read_csv('lidar_study_areas.csv', index_col=0)
 study_areas = study_areas_df.to_dict('index')
 
+# Coordinate reference systems for each MGA zone
+mga_crs = {54: 'EPSG:28354', 55: 'EPSG:28355', 56: 'EPSG:28356'}
+
 for name in study_areas.keys():
 
     # Read in study area details
@@ -40,16 +68,15 @@ for name in study_areas.keys():
 
         # Convert lat-lon coordinates to local MGA zone
         mga_zone = study_areas[name]['mga_zone']
-        proj_crs = {54: 'EPSG:28354', 55: 'EPSG:28355', 56: 'EPSG:28356'}[mga_zone]
-        (ul_x, br_x), (ul_y, br_y) = transform(p1=Proj(init='EPSG:4326'), p2=Proj(init=proj_crs),
-                                               x=[ul_lon, br_lon], y=[ul_lat, br_lat])
+        proj_crs = mga_crs[mga_zone]
+        (ul_x, br_x), (ul_y, br_y) = get_transformer('EPSG:4326', proj_crs).transform([ul_lon, br_lon],
+                                                                                      [ul_lat, br_lat])
 
         # For each unique combination of 1x1km coordinates, produce file string
         all_combs = list(itertools.product(range(int(ul_x), int(br_x), 1000),
                                            range(int(ul_y), int(br_y), -1000)))
         loc_strings = set([str(math.floor(x / 1000)) + str(math.floor(y / 1000)) for x, y in all_combs])
         file_keys = [study_areas[name]['input_name'].format(loc) for loc in loc_strings]
-        print(len(file_keys))
 
         ########################
         # Extract LAS into csv #
@@ -60,7 +87,7 @@ for name in study_areas.keys():
             input_filename = '{}{}.las'.format(input_location, file_key)
             output_dir = os.path.normpath('{}/raw_data/validation'.format(os.getcwd()))
             output_filename = "{}_{}.csv".format(mga_zone, file_key)
-            print('Downloading and extracting {}, MGA zone {}'.format(file_key, mga_zone))
+            logger.info('Downloading and extracting %s, MGA zone %s', file_key, mga_zone)
 
             # If input file exists and not already processed, extract from LAS
             if os.path.isfile(input_filename) and not os.path.isfile('raw_data/validation/{}'.format(output_filename)):
@@ -76,18 +103,20 @@ for name in study_areas.keys():
                                       '-parse xyzcpt -sep comma'.format(input_filename, output_dir)
                     os.system(las2text_string)
 
-                    # Read temporary file in and convert coordinates to lat/long
-                    points_df = pd.read_csv('{}/temp.txt'.format(output_dir), sep=',', header=None,
-                                            names=['point_x', 'point_y', 'point_z',
-                                                   'point_cat', 'point_path', 'point_time'])
+                    # Read temporary file in and convert coordinates to lat/long. This uses the multithreaded
+                    # pyarrow CSV reader, which parses large point files much faster than pandas
+                    read_options = pacsv.ReadOptions(column_names=['point_x', 'point_y', 'point_z',
+                                                                   'point_cat', 'point_path', 'point_time'])
+                    points_df = pacsv.read_csv('{}/temp.txt'.format(output_dir), read_options=read_options,
+                                               parse_options=pacsv.ParseOptions(delimiter=',')).to_pandas()
 
                     # Assign tide point
                     tidepoint_lon, tidepoint_lat = [float(coord) for coord in
                                                     study_areas[name]['tide_point'].split(",")]
 
                     # Compute lon-lat coordinates for each point
-                    point_lon, point_lat = transform(p1=Proj(init=proj_crs), p2=Proj(init='EPSG:4326'),
-                                                     x=points_df['point_x'].values, y=points_df['point_y'].values)
+                    point_lon, point_lat = get_transformer(proj_crs, 'EPSG:4326').transform(
+                        points_df['point_x'].values, points_df['point_y'].values)
 
                     # Assign tidepoint and point lon/lat to columns
                     points_df['tidepoint_lon'] = tidepoint_lon
@@ -104,7 +133,7 @@ for name in study_areas.keys():
 
                 except:
 
-                    print('Failed tile {}'.format(file_key))
+                    logger.exception('Failed tile %s', file_key)
 
 
 #####################
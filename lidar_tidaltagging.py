@@ -14,12 +14,16 @@
 
 import glob
 import os
+import logging
 import pandas as pd
 import numpy as np
 import datetime as dt
 from otps.predict_wrapper import predict_tide
 from otps import TimePoint
-from pytz import timezone
+
+# Report progress using a logger rather than printing directly to stdout
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+logger = logging.getLogger(__name__)
 
 
 def gps_week(input_datetime):
@@ -42,65 +46,65 @@ def gps_week(input_datetime):
 
 def gps_adj_utc(gps_adj, leap_seconds=10):
     """
-    Converts between adjusted GPS time and UTC, returning a datetime object.
+    Converts between adjusted GPS time and UTC, returning datetimes.
     This assumes adjusted GPS time has already had - 1 billion subtracted from it;
     if you have unadjusted GPS time instead, subtract 1 billion before inputting
-    it into this function.
+    it into this function. Times are converted for all values at once using
+    integer arithmetic, rather than by creating a datetime object for each value.
 
-    :param gps_adj: Adjusted GPS time
+    :param gps_adj: Pandas series or array-like of adjusted GPS times
     :param leap_seconds: Leap seconds since start of GPS epoch; default 10
-    :return: Datetime object with converted time in UTC
+    :return: Pandas series of datetimes with converted time in UTC
     """
 
     # Identify UTC and GPS epochs and compute offset between them
     utc_epoch = dt.datetime(1970, 1, 1)
     gps_epoch = dt.datetime(1980, 1, 6)
-    utc_offset = (gps_epoch - utc_epoch).total_seconds() - leap_seconds
-
-    # Convert to unix time then UTC by adding 1 billion + UTC offset to GPS time
-    unix_timestamp = utc_offset + (int(gps_adj) + 1000000000)
-    utc_time = dt.datetime.utcfromtimestamp(unix_timestamp)
+    utc_offset = int((gps_epoch - utc_epoch).total_seconds()) - leap_seconds
 
-    # Set UTC timezone info
-    utc_time = utc_time.replace(tzinfo=timezone('UTC'))
+    # Convert to unix time then UTC by adding 1 billion + UTC offset to GPS time. Casting to int64 truncates
+    # fractional seconds towards zero, matching `int()`
+    unix_timestamp = pd.Series(gps_adj).astype('int64') + 1000000000 + utc_offset
+    utc_time = pd.to_datetime(unix_timestamp, unit='s', utc=True)
 
     return utc_time
 
 
 def gps_sotw_utc(gps_sotw, reference_date, leap_seconds=10):
     """
-    Computes UTC time from GPS Seconds of Week format time
+    Computes UTC time from GPS Seconds of Week format time. Times are converted for
+    all values at once using integer arithmetic, rather than by creating a datetime
+    object for each value.
 
-    :param gps_sotw: GPS seconds-of-the-week value
+    :param gps_sotw: Pandas series or array-like of GPS seconds-of-the-week values
     :param reference_date: Date used to compute current GPS week number
     :param leap_seconds: Leap seconds since start of GPS epoch; default 10
-    :return: Datetime object with converted time in UTC
+    :return: Pandas series of datetimes with converted time in UTC; values outside
+        of 0 to 604800 seconds are returned as NaT
     """
 
-    # First test if GPS seconds-of-week fall within 0 and 604800 seconds
-    if 0 <= int(gps_sotw) <= dt.timedelta(days=7).total_seconds():
-
-        # Identify UTC and GPS epochs and compute offset between them
-        utc_epoch = dt.datetime(1970, 1, 1)
-        gps_epoch = dt.datetime(1980, 1, 6)
-        utc_offset = (gps_epoch - utc_epoch).total_seconds() - leap_seconds
+    # Identify UTC and GPS epochs and compute offset between them
+    utc_epoch = dt.datetime(1970, 1, 1)
+    gps_epoch = dt.datetime(1980, 1, 6)
+    utc_offset = int((gps_epoch - utc_epoch).total_seconds()) - leap_seconds
 
-        # Identify GPS week
-        gps_week_num = gps_week(reference_date)
+    # Identify GPS week, and compute the UTC time at the start of the GPS week
+    gps_week_num = gps_week(reference_date)
+    utc_basetime = pd.Timestamp(utc_offset + gps_week_num * 7 * 86400, unit='s', tz='UTC')
 
-        # Compute difference between UTC epoch and GPS time, then add GPS week days
-        unix_timestamp = utc_offset + int(gps_sotw)
-        utc_basetime = dt.datetime.utcfromtimestamp(unix_timestamp)
-        utc_time = utc_basetime + dt.timedelta(days=gps_week_num * 7)
+    # Add GPS seconds-of-week to start of GPS week
+    gps_sotw = pd.Series(gps_sotw).astype('int64')
+    utc_time = utc_basetime + pd.to_timedelta(gps_sotw, unit='s')
 
-        # Set UTC timezone info
-        utc_time = utc_time.replace(tzinfo=timezone('UTC'))
+    # Test if GPS seconds-of-week fall within 0 and 604800 seconds
+    invalid = (gps_sotw < 0) | (gps_sotw > dt.timedelta(days=7).total_seconds())
 
-        return utc_time
+    if invalid.any():
+        logger.warning("GPS seconds-of-week must be between 0 and 604800 seconds; "
+                       "setting %s invalid values to NaT", invalid.sum())
+        utc_time[invalid.values] = pd.NaT
 
-    else:
-        print("GPS seconds-of-week must be between 0 and 604800 seconds")
-        return None
+    return utc_time
 
 
 #########
@@ -124,61 +128,78 @@ for name in ['SAcoastal']:
     # Test if tidal tagging is required for area
     if not pd.isnull(input_location):
 
-        print(name)
+        logger.info(name)
+
+        # Point files are processed and exported one at a time, appending to a single output .csv, so that only
+        # one file of points needs to be held in memory at once. Modelled tides are cached by location and time
+        # so that tides are only modelled once, even if the same time occurs in multiple files
+        point_files = sorted(glob.glob('raw_data/validation/*{}*.csv'.format(name)))
+        output_file = 'output_data/validation/output_points_{}.csv'.format(name)
+        tide_cache = {}
+
+        # Remove any existing output, as points are appended to file
+        if os.path.exists(output_file):
+            os.remove(output_file)
 
-        ###############
-        # Import data #
-        ###############
+        for file_num, input_file in enumerate(point_files):
 
-        # Iterate through each file and merge list of dataframes into single dataframe
-        point_files = glob.glob('raw_data/validation/*{}*.csv'.format(name))
-        df_list = [pd.read_csv(input_file, sep=",") for input_file in point_files]
-        points_df = pd.concat(df_list)
+            ###############
+            # Import data #
+            ###############
 
+            # Tide point coordinates are read as float32, which is plenty of precision for locating tide model
+            # points (< 1 m) and halves the size of the keys used to join modelled tides back onto points
+            points_df = pd.read_csv(input_file, sep=",",
+                                    dtype={'tidepoint_lat': np.float32, 'tidepoint_lon': np.float32})
 
-        ################
-        # Convert time #
-        ################
 
-        if points_df.point_time.iloc[0] < 0:
+            ################
+            # Convert time #
+            ################
 
-            # Convert GPS time to datetime, and round to nearest minute to reduce calls to tide_predict
-            print('Time in adjusted GPS format')
-            points_df['point_time'] = points_df['point_time'].apply(lambda ts: gps_adj_utc(ts))
-            points_df['point_timeagg'] = points_df['point_time'].dt.round('1min')
+            if points_df.point_time.iloc[0] < 0:
 
-        else:
+                # Convert GPS time to datetime, and round to nearest minute to reduce calls to tide_predict
+                logger.debug('Time in adjusted GPS format')
+                points_df['point_time'] = gps_adj_utc(points_df['point_time'])
+                points_df['point_timeagg'] = points_df['point_time'].dt.round('1min')
 
-            # Convert GPS time to datetime, and round to nearest minute to reduce calls to tide_predict
-            print('Time in GPS seconds-of-the-week format')
-            ref_date = dt.datetime.strptime(study_areas[name]['ref_date'], '%Y-%m-%d %H:%M:%S')
-            points_df['point_time'] = points_df['point_time'].apply(lambda ts: gps_sotw_utc(ts, ref_date))
-            points_df['point_timeagg'] = points_df['point_time'].dt.round('1min')
+            else:
 
+                # Convert GPS time to datetime, and round to nearest minute to reduce calls to tide_predict
+                logger.debug('Time in GPS seconds-of-the-week format')
+                ref_date = dt.datetime.strptime(study_areas[name]['ref_date'], '%Y-%m-%d %H:%M:%S')
+                points_df['point_time'] = gps_sotw_utc(points_df['point_time'], ref_date)
+                points_df['point_timeagg'] = points_df['point_time'].dt.round('1min')
 
-        #################
-        # Compute tides #
-        #################
 
-        # Group into unique times and locations, create TimePoints and model tides
-        grouped_series = points_df.groupby(['tidepoint_lat', 'tidepoint_lon', 'point_timeagg'])
-        grouped_series = grouped_series.apply(lambda row: TimePoint(lon=row.iloc[0]['tidepoint_lon'],
-                                                                    lat=row.iloc[0]['tidepoint_lat'],
-                                                                    timestamp=row.iloc[0]['point_timeagg']))
+            #################
+            # Compute tides #
+            #################
 
-        # Convert grouped data to dataframe and compute tides
-        grouped_df = grouped_series.to_frame(name='point_tidal')
-        grouped_df['point_tidal'] = [float(tp.tide_m) for tp in predict_tide(list(grouped_series))]
+            # Identify unique times and locations, then create TimePoints and model tides for any that have not
+            # already been modelled for a previous file
+            tide_keys = ['tidepoint_lat', 'tidepoint_lon', 'point_timeagg']
+            unique_df = points_df[tide_keys].dropna().drop_duplicates().reset_index(drop=True)
+            unique_keys = list(unique_df.itertuples(index=False, name=None))
+            new_keys = [key for key in unique_keys if key not in tide_cache]
+            if new_keys:
+                timepoints = [TimePoint(lon=float(lon), lat=float(lat), timestamp=timestamp)
+                              for lat, lon, timestamp in new_keys]
+                tide_cache.update(zip(new_keys, [float(tp.tide_m) for tp in predict_tide(timepoints)]))
 
-        # Join back into main dataframe
-        points_df = points_df.join(grouped_df, on=['tidepoint_lat', 'tidepoint_lon', 'point_timeagg'], rsuffix="_test")
+            unique_df['point_tidal'] = [tide_cache[key] for key in unique_keys]
 
-        # Filter to keep only points located higher than instantaneous tide height and below max overall tide height
-        filteredpoints_df = points_df[(points_df.point_z > (points_df.point_tidal + 0.15))]
-        print('Discarding {} points below or at tidal height'.format(len(points_df) - len(filteredpoints_df)))
+            # Join back into main dataframe. As the keys in `unique_df` are unique, this is a single flat hash join
+            points_df = points_df.merge(unique_df, on=tide_keys, how='left', validate='many_to_one')
 
-        # Select output columns and export to file
-        filteredpoints_df = filteredpoints_df[['point_lon', 'point_lat', 'point_z', 'point_tidal',
-                                               'point_cat', 'point_path', 'point_time', 'point_timeagg']]
-        filteredpoints_df.to_csv('output_data/validation/output_points_{}.csv'.format(name), index=False)
+            # Filter to keep only points located higher than instantaneous tide height and below max overall tide
+            # height
+            filteredpoints_df = points_df[(points_df.point_z > (points_df.point_tidal + 0.15))]
+            logger.info('Discarding %s points below or at tidal height from %s',
+                        len(points_df) - len(filteredpoints_df), input_file)
 
+            # Select output columns and append to file, writing column names only for the first file
+            filteredpoints_df = filteredpoints_df[['point_lon', 'point_lat', 'point_z', 'point_tidal',
+                                                   'point_cat', 'point_path', 'point_time', 'point_timeagg']]
+            filteredpoints_df.to_csv(output_file, mode='a', header=(file_num == 0), index=False)
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from scipy import ndimage as nd
+
+pytest.importorskip('osgeo')
+pytest.importorskip('fiona')
+
+import NIDEM_generation as ng
+
+
+def edt_fill(arr, valid_mask):
+
+    """
+    Baseline boundary fill: fills every nodata pixel with the value of the nearest pixel with data using
+    `distance_transform_edt`, then sets pixels more than two pixels from data back to NaN.
+
+    """
+
+    ring_mask = nd.binary_dilation(valid_mask, iterations=2)
+    nearest_inds = nd.distance_transform_edt(input=~valid_mask, return_distances=False, return_indices=True)
+    filled = arr[tuple(nearest_inds)]
+    filled[~ring_mask] = np.nan
+
+    return filled
+
+
+def ring_fill(arr, valid_mask):
+
+    filled = arr.copy()
+    ring_mask = nd.binary_dilation(valid_mask, structure=ng.FILL_RING_STRUCTURE)
+    ng.fill_ring(filled, valid_mask, ring_mask)
+    filled[~ring_mask] = np.nan
+
+    return filled
+
+
+def test_fill_ring_ties():
+
+    # Each nodata pixel is surrounded by several equally near pixels with different values, so the output depends
+    # on how ties are resolved
+    arr = np.full((9, 9), np.nan, dtype=np.float32)
+    arr[4, 2], arr[4, 6], arr[2, 4], arr[6, 4] = 1, 2, 3, 4
+    arr[1, 1], arr[1, 7], arr[7, 1], arr[7, 7] = 5, 6, 7, 8
+    valid_mask = ~np.isnan(arr)
+
+    np.testing.assert_array_equal(ring_fill(arr, valid_mask), edt_fill(arr, valid_mask))
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_fill_ring_matches_edt(seed):
+
+    rng = np.random.default_rng(seed)
+    shape = tuple(rng.integers(5, 60, size=2))
+    arr = rng.integers(0, 1000, size=shape).astype(np.float32)
+    valid_mask = rng.random(shape) < rng.uniform(0.03, 0.7)
+    arr[~valid_mask] = np.nan
+
+    np.testing.assert_array_equal(ring_fill(arr, valid_mask), edt_fill(arr, valid_mask))